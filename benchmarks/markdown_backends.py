@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the markdown backends on a corpus of incident bodies.
+
+    python benchmarks/markdown_backends.py --incidents 200 --repeat 3
+
+Every backend is timed three ways: rendering the whole corpus sequentially, rendering the whole
+corpus on the process pool and rendering it in batches through iter_incidents, the way
+`statuspage update` does. The last column shows how many batches went to the pool.
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import random
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "statuspage"))
+
+import statuspage  # noqa: E402
+from statuspage import MARKDOWN_BACKENDS, MarkdownRenderer, iter_incidents  # noqa: E402
+from statuspage import SYSTEM_LABEL_COLOR  # noqa: E402
+
+SYSTEMS = ["Website", "API", "Database", "CDN", "Payments", "Search"]
+
+UPDATE = """We are continuing to monitor **{system}**. Error rates are back at {rate}% and
+latency is recovering. See the [dashboard](https://example.com/dashboards/{n}) for details.
+"""
+
+POSTMORTEM = """## Summary
+
+Between 14:{n:02d} and 15:{n:02d} UTC requests to **{system}** failed with an elevated error
+rate of up to {rate}%. Customers saw timeouts and `502 Bad Gateway` responses.
+
+## Timeline
+
+* 14:{n:02d} - Alerts fired for {system} error rate
+* 14:{m:02d} - On-call engineer acknowledged the page
+* 14:{k:02d} - Faulty deploy identified and rolled back
+* 15:{n:02d} - Error rates back to normal
+
+## Root cause
+
+A configuration change reduced the connection pool of *{system}* from 200 to 20:
+
+    pool:
+      max_connections: 20
+      timeout: 5s
+
+Under peak load requests queued up until they hit the upstream timeout. See
+[the incident ticket](https://example.com/tickets/{n}) and the
+<a href="https://example.com/graphs/{n}">raw graphs</a>.
+
+## Action items
+
+1. Add a check for connection pool settings to the deploy pipeline
+2. Alert on queue depth, not only on error rate
+3. Document the rollback procedure for {system}
+
+> We are sorry for the inconvenience this caused.
+"""
+
+
+class Label(object):
+
+    def __init__(self, name, color):
+        self.name = name
+        self.color = color
+
+
+class User(object):
+
+    def __init__(self, login):
+        self.login = login
+
+
+class Comment(object):
+
+    def __init__(self, body):
+        self.body = body
+        self.created_at = None
+        self.user = User("some-dude")
+
+
+class Issue(object):
+
+    def __init__(self, title, body, comments, system):
+        self.title = title
+        self.body = body
+        self.state = "closed"
+        self.created_at = None
+        self.user = User("some-dude")
+        self.comments = comments
+        self.labels = [Label(system, SYSTEM_LABEL_COLOR), Label("major outage", "FF4D4D")]
+
+    def get_labels(self):
+        return self.labels
+
+    def get_comments(self):
+        return self.comments
+
+
+def make_corpus(incidents, seed=0):
+    """
+    Returns a list of issues that look like incidents with updates. Roughly one in five
+    incidents is a long post-mortem, the others are short updates.
+    """
+    rnd = random.Random(seed)
+    issues = []
+    for n in range(incidents):
+        values = dict(
+            system=rnd.choice(SYSTEMS),
+            rate=rnd.randint(1, 100),
+            n=n % 60,
+            m=(n + 7) % 60,
+            k=(n + 23) % 60,
+        )
+        body = POSTMORTEM.format(**values) if n % 5 == 0 else UPDATE.format(**values)
+        comments = [Comment(UPDATE.format(**values)) for _ in range(rnd.randint(0, 4))]
+        issues.append(Issue("Incident {}".format(n), body, comments, values["system"]))
+    return issues
+
+
+class CountingRenderer(MarkdownRenderer):
+    """
+    Remembers for every batch whether it was rendered on the pool.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(CountingRenderer, self).__init__(*args, **kwargs)
+        self.batches = []
+
+    def render_all(self, texts):
+        self.batches.append(self.is_parallel(texts))
+        return super(CountingRenderer, self).render_all(texts)
+
+
+def render_corpus(renderer, texts):
+    renderer.render_all(texts)
+
+
+def render_batches(renderer, issues):
+    for _ in iter_incidents(issues, ["some-dude"], renderer):
+        pass
+
+
+def run(backend, processes, repeat, func, *args):
+    """
+    Returns the best time in ms and the number of batches rendered on the pool.
+    """
+    renderer = CountingRenderer(backend=backend, processes=processes)
+    try:
+        # render once to start the pool, so that it doesn't count towards the timing
+        func(renderer, *args)
+        parallel = "{}/{}".format(sum(renderer.batches), len(renderer.batches))
+        best = min(timeit.repeat(lambda: func(renderer, *args), number=1, repeat=repeat))
+    finally:
+        renderer.close()
+    return best * 1000, parallel
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--incidents", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    issues = make_corpus(args.incidents)
+    texts = []
+    for issue in issues:
+        texts.append(issue.body)
+        texts.extend(comment.body for comment in issue.comments)
+    size = sum(len(text) for text in texts)
+    print("{} texts, {:.1f} KiB of markdown\n".format(len(texts), size / 1024.0))
+    print("{:<10} {:<10} {:>11} {:>9}".format("backend", "mode", "time", "on pool"))
+
+    threshold = statuspage.PARALLEL_RENDER_THRESHOLD
+    for backend in MARKDOWN_BACKENDS:
+        results = [
+            ("sequential", run(backend, 1, args.repeat, render_corpus, texts)),
+        ]
+        # force the whole corpus onto the pool, no matter how large it is
+        statuspage.PARALLEL_RENDER_THRESHOLD = 0
+        try:
+            results.append(
+                ("parallel", run(backend, args.processes, args.repeat, render_corpus, texts))
+            )
+        finally:
+            statuspage.PARALLEL_RENDER_THRESHOLD = threshold
+        results.append(
+            ("batched", run(backend, args.processes, args.repeat, render_batches, issues))
+        )
+
+        for mode, (ms, parallel) in results:
+            print("{:<10} {:<10} {:8.1f} ms {:>9}".format(backend, mode, ms, parallel))
+
+
+if __name__ == '__main__':
+    main()
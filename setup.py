@@ -40,6 +40,9 @@ setup(
     package_data={'': ["template/*"]},
     include_package_data=True,
     install_requires=requirements,
+    extras_require={
+        'mistune': ['mistune>=2.0,<4'],
+    },
     license='MIT',
     zip_safe=False,
     classifiers=[
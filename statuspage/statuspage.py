@@ -2,8 +2,12 @@
 from __future__ import absolute_import, print_function
 
 import sys, os
+import io
 import hashlib
 import base64
+import shutil
+import subprocess
+import tempfile
 from datetime import datetime, timedelta
 import requests
 from requests.exceptions import ConnectionError
@@ -14,6 +18,17 @@ from tqdm import tqdm
 from collections import OrderedDict
 import markdown2
 import json
+import multiprocessing
+
+try:
+    import mistune
+except ImportError:  # pragma: no cover
+    mistune = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
 
 __version__ = "1.0"
 
@@ -38,6 +53,10 @@ TEMPLATES = [
     "translations.ini"
 ]
 
+# incidents are rendered in batches of at least this many characters of markdown, these
+# batches are rendered on a process pool. Only the last batch can be smaller
+PARALLEL_RENDER_THRESHOLD = 64 * 1024
+
 DEFAULT_CONFIG = {
     "footer": "Status page hosted by GitHub, generated with <a href='https://github.com/jayfk/statuspage'>jayfk/statuspage</a>",
     "logo": "https://raw.githubusercontent.com/jayfk/statuspage/main/template/logo.png",
@@ -46,6 +65,22 @@ DEFAULT_CONFIG = {
 }
 
 
+def render_markdown2(text):
+    return markdown2.markdown(text)
+
+
+def render_mistune(text):
+    # don't escape raw HTML, same as markdown2
+    return mistune.markdown(text, escape=False)
+
+
+# available markdown backends, the functions need to live on module level so that they can be
+# sent to the process pool
+MARKDOWN_BACKENDS = OrderedDict([("markdown2", render_markdown2)])
+if mistune is not None:
+    MARKDOWN_BACKENDS["mistune"] = render_mistune
+
+
 @click.group()
 @click.version_option(__version__, '-v', '--version')
 def cli():  # pragma: no cover
@@ -58,24 +93,44 @@ def cli():  # pragma: no cover
 @click.option('--org', help='GitHub Organization', default=False)
 @click.option('--systems', prompt='Systems, eg (Website,API)', help='')
 @click.option('--private/--public', default=False)
-def create(token, name, systems, org, private):
-    run_create(name=name, token=token, systems=systems, org=org, private=private)
+@click.option('--git-dir', default=None,
+              help='Publish through a local clone of the gh-pages branch in this directory')
+@click.option('--git-remote', default=None,
+              help='Remote the local clone pushes to, defaults to the GitHub repo')
+def create(token, name, systems, org, private, git_dir, git_remote):
+    run_create(name=name, token=token, systems=systems, org=org, private=private,
+               git_dir=git_dir, git_remote=git_remote)
 
 
 @cli.command()
 @click.option('--name', prompt='Name', help='')
 @click.option('--org', help='GitHub Organization', default=False)
 @click.option('--token', prompt='GitHub API Token', help='')
-def update(name, token, org):
-    run_update(name=name, token=token, org=org)
+@click.option('--markdown', type=click.Choice(list(MARKDOWN_BACKENDS)), default="markdown2",
+              help='Markdown backend used to render incidents')
+@click.option('--processes', type=click.IntRange(min=1), default=None,
+              help='Number of processes used to render large batches of incidents')
+@click.option('--git-dir', default=None,
+              help='Publish through a local clone of the gh-pages branch in this directory')
+@click.option('--git-remote', default=None,
+              help='Remote the local clone pushes to, defaults to the GitHub repo')
+@click.option('--output-dir', default=None,
+              help='Publish to this local directory instead of the gh-pages branch')
+def update(name, token, org, markdown, processes, git_dir, git_remote, output_dir):
+    run_update(name=name, token=token, org=org, markdown=markdown, processes=processes,
+               git_dir=git_dir, git_remote=git_remote, output_dir=output_dir)
 
 
 @cli.command()
 @click.option('--name', prompt='Name', help='')
 @click.option('--org', help='GitHub Organization', default=False)
 @click.option('--token', prompt='GitHub API Token', help='')
-def upgrade(name, token, org):
-    run_upgrade(name=name, token=token, org=org)
+@click.option('--git-dir', default=None,
+              help='Publish through a local clone of the gh-pages branch in this directory')
+@click.option('--git-remote', default=None,
+              help='Remote the local clone pushes to, defaults to the GitHub repo')
+def upgrade(name, token, org, git_dir, git_remote):
+    run_upgrade(name=name, token=token, org=org, git_dir=git_dir, git_remote=git_remote)
 
 
 @cli.command()
@@ -131,97 +186,59 @@ def run_remove_system(name, token, org, system, prompt):
         click.secho("Unable to remove system {}, it does not exist.".format(system), fg="yellow")
 
 
-def run_upgrade(name, token, org):
+def run_upgrade(name, token, org, git_dir=None, git_remote=None):
     click.echo("Upgrading...")
 
     repo = get_repo(token=token, name=name, org=org)
-    files = get_files(repo=repo)
-    head_sha = repo.get_git_ref("heads/gh-pages").object.sha
+    output = get_output(repo=repo, token=token, git_dir=git_dir, git_remote=git_remote)
 
     # add all the template files to the gh-pages branch
-    for template in tqdm(TEMPLATES, desc="Updating template files"):
-        with open(os.path.join(ROOT, "template", template), "r") as f:
-            content = f.read()
-            if template in files:
-                repo_template = repo.get_contents(
-                    path=template,
-                    ref=head_sha,
-                )
-                if not is_same_content(
-                    content,
-                    base64.b64decode(repo_template.content).decode('utf-8')
-                ):
-                    repo.update_file(
-                        path=template,
-                        sha=repo_template.sha,
-                        message="upgrade",
-                        content=content,
-                        branch="gh-pages"
-                    )
-            else:
-                repo.create_file(
-                    path=template,
-                    message="upgrade",
-                    content=content,
-                    branch="gh-pages"
-                )
+    write_templates(output=output, message="upgrade", desc="Updating template files")
+    output.commit(message="upgrade")
 
 
-def run_update(name, token, org):
+def run_update(name, token, org, markdown="markdown2", processes=None, git_dir=None,
+               git_remote=None, output_dir=None):
     click.echo("Generating..")
     repo = get_repo(token=token, name=name, org=org)
     issues = get_issues(repo)
-
-    # get the SHA of the current HEAD
-    sha = repo.get_git_ref("heads/gh-pages").object.sha
-
-    # get the template from the repo
-    template_file = repo.get_contents(
-        path="template.html",
-        ref=sha
+    output = get_output(
+        repo=repo, token=token, git_dir=git_dir, git_remote=git_remote, output_dir=output_dir
     )
-
-    systems = get_systems(repo, issues)
-    incidents = get_incidents(repo, issues)
-    panels = get_panels(systems)
-
-    # render the template
-    config = get_config(repo)
-    template = Template(template_file.decoded_content.decode("utf-8"))
-    content = template.render({
-        "systems": systems, "incidents": incidents, "panels": panels, "config": config
-    })
-
-    # create/update the index.html with the template
     try:
-        # get the index.html file, we need the sha to update it
-        index = repo.get_contents(
-            path="index.html",
-            ref=sha,
-        )
-
-        if is_same_content(content, base64.b64decode(index.content).decode('utf-8')):
-            click.echo("Local status matches remote status, no need to commit.")
-            return False
+        if output_dir:
+            # the directory is served on its own, it needs the template files next to the index
+            write_templates(output=output, message="update", desc="Updating template files")
+
+        systems = get_systems(repo, issues)
+        renderer = MarkdownRenderer(backend=markdown, processes=processes)
+        incidents = get_incidents(repo, issues, renderer)
+        panels = get_panels(systems)
+
+        # render the template from the repo, streaming the output into an upload buffer
+        config = get_config(output)
+        template = Template(output.read("template.html"))
+        try:
+            content, digest = render_to_buffer(template, {
+                "systems": systems, "incidents": incidents, "panels": panels, "config": config
+            })
+        finally:
+            renderer.close()
+
+        # create/update the index.html with the template
+        output.write(path="index.html", content=content, message="update index", sha1=digest)
+        published = output.commit(message="update index")
+    except BaseException:
+        # don't leave anything half written behind, e.g. when the GitHub API is unavailable
+        output.abort()
+        raise
 
-        repo.update_file(
-            path="index.html",
-            sha=index.sha,
-            message="update index",
-            content=content,
-            branch="gh-pages"
-        )
-    except UnknownObjectException:
-        # index.html does not exist, create it
-        repo.create_file(
-            path="index.html",
-            message="initial",
-            content=content,
-            branch="gh-pages",
-        )
+    if not published:
+        click.echo("Local status matches remote status, no need to commit.")
+        return False
 
 
-def run_create(name, token, systems, org, private):
+def run_create(name, token, systems, org, private, git_dir=None, git_remote=None):
     gh = Github(token)
 
     if org:
@@ -261,21 +278,18 @@ def run_create(name, token, systems, org, private):
     ref = repo.get_git_ref("heads/main")
     repo.create_git_ref(ref="refs/heads/gh-pages", sha=ref.object.sha)
 
-    # add all the template files to the gh-pages branch
-    for template in tqdm(TEMPLATES, desc="Adding template files"):
-        with open(os.path.join(ROOT, "template", template), "r", encoding='utf-8') as f:
-            repo.create_file(
-                path=template,
-                message="initial",
-                content=f.read(),
-                branch="gh-pages"
-            )
+    # add all the template files to the gh-pages branch, it only contains the README so far
+    output = get_output(
+        repo=repo, token=token, git_dir=git_dir, git_remote=git_remote, files=["README.md"]
+    )
+    write_templates(output=output, message="initial", desc="Adding template files")
+    output.commit(message="initial")
 
     # set the gh-pages branch to be the default branch
     repo.edit(name=name, default_branch="gh-pages")
 
     # run an initial update to add content to the index
-    run_update(token=token, name=name, org=org)
+    run_update(token=token, name=name, org=org, git_dir=git_dir, git_remote=git_remote)
 
     click.echo("\nCreate new issues at https://github.com/{login}/{name}/issues".format(
         login=entity.login,
@@ -301,25 +315,48 @@ def iter_systems(labels):
             yield label.name
 
 
-def get_files(repo):
+def get_files(repo, ref="gh-pages"):
     """
     Get a list of all files.
     """
-    return [file.path for file in repo.get_contents("/", ref="gh-pages")]
+    return [file.path for file in repo.get_contents("/", ref=ref)]
+
+
+def get_output(repo, token, git_dir=None, git_remote=None, output_dir=None, files=None):
+    """
+    Get the output the page is written to. This is a local directory if `output_dir` is set,
+    a local clone of the gh-pages branch if `git_dir` is set and the contents API otherwise.
+    """
+    if output_dir:
+        output_dir = os.path.expanduser(output_dir)
+        if git_dir or git_remote:
+            raise click.UsageError("--output-dir can't be combined with --git-dir or --git-remote.")
+        return DirectoryOutput(path=output_dir)
+    if git_dir:
+        git_dir = os.path.expanduser(git_dir)
+        if not git_remote:
+            git_remote = "https://github.com/{name}.git".format(name=repo.full_name)
+        return GitOutput(path=git_dir, remote=git_remote, token=token)
+    return GitHubOutput(repo=repo, files=files)
+
+
+def write_templates(output, message, desc):
+    for template in tqdm(TEMPLATES, desc=desc):
+        with open(os.path.join(ROOT, "template", template), "r", encoding='utf-8') as f:
+            output.write(path=template, content=f.read(), message=message)
 
 
-def get_config(repo):
+def get_config(output):
     """
     Get the config for the repo, merged with the default config. Returns the default config if
     no config file is found.
     """
-    files = get_files(repo)
     config = DEFAULT_CONFIG
-    if "config.json" in files:
-        # get the config file, parse JSON and merge it with the default config
-        config_file = repo.get_contents('config.json', ref="gh-pages")
+    content = output.read("config.json")
+    if content is not None:
+        # parse the config file and merge it with the default config
         try:
-            repo_config = json.loads(config_file.decoded_content.decode("utf-8"))
+            repo_config = json.loads(content)
             config.update(repo_config)
         except ValueError:
             click.secho("WARNING: Unable to parse config file. Using defaults.", fg="yellow")
@@ -376,10 +413,376 @@ def get_systems(repo, issues):
     return systems
 
 
-def get_incidents(repo, issues):
-    # loop over all issues in the past 90 days to get current and past incidents
-    incidents = []
-    collaborators = get_collaborators(repo=repo)
+class MarkdownRenderer(object):
+    """
+    Renders batches of markdown with one of the MARKDOWN_BACKENDS. Batches that are larger than
+    PARALLEL_RENDER_THRESHOLD are rendered on a process pool, which is created on first use.
+    """
+
+    def __init__(self, backend="markdown2", processes=None):
+        self.render = MARKDOWN_BACKENDS[backend]
+        self.processes = processes
+        self.pool = None
+
+    def is_parallel(self, texts):
+        return self.processes != 1 and len(texts) > 1 and \
+            sum(len(text) for text in texts) >= PARALLEL_RENDER_THRESHOLD
+
+    def render_all(self, texts):
+        if not self.is_parallel(texts):
+            return [self.render(text) for text in texts]
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.processes)
+        # map keeps the order of the texts, the output is the same as when rendering sequentially
+        return self.pool.map(self.render, texts)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+class GitHubOutput(object):
+    """
+    Writes files to the gh-pages branch through the contents API, every file that changes is
+    committed on its own.
+    """
+
+    def __init__(self, repo, files=None, branch="gh-pages"):
+        self.repo = repo
+        self.branch = branch
+        self.changed = False
+        # get the SHA of the current HEAD
+        self.sha = repo.get_git_ref("heads/" + branch).object.sha
+        if files is None:
+            files = get_files(repo=repo, ref=self.sha)
+        self.files = set(files)
+
+    def read(self, path):
+        if path not in self.files:
+            return None
+        return self.repo.get_contents(path=path, ref=self.sha).decoded_content.decode("utf-8")
+
+    def write(self, path, content, message, sha1=None):
+        """
+        Creates or updates the file. Returns False if the file already has this content.
+        """
+        if path not in self.files:
+            self.repo.create_file(path=path, message=message, content=content, branch=self.branch)
+            self.files.add(path)
+            self.changed = True
+            return True
+
+        # get the file, we need the sha to update it
+        current = self.repo.get_contents(path=path, ref=self.sha)
+        if (sha1 or content_sha1(content)) == content_sha1(base64.b64decode(current.content)):
+            return False
+        self.repo.update_file(
+            path=path,
+            sha=current.sha,
+            message=message,
+            content=content,
+            branch=self.branch
+        )
+        self.changed = True
+        return True
+
+    def commit(self, message):
+        """
+        Returns False if nothing changed, every write has been committed already.
+        """
+        return self.changed
+
+    def abort(self):
+        pass
+
+
+class GitOutput(object):
+    """
+    Writes files to a persistent local clone of the gh-pages branch. Nothing is published until
+    commit() is called, which commits all changed files at once and pushes them to `remote`.
+    The remote can be any URL or path git understands, e.g. a local bare repo.
+    """
+
+    def __init__(self, path, remote, token=None, branch="gh-pages"):
+        self.path = path
+        self.remote = remote
+        self.branch = branch
+        self.env = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+        if token:
+            # pass the token as an auth header for github.com through the environment, so that
+            # it never shows up in the remote URL, in the process list or in error messages
+            auth = base64.b64encode("x-access-token:{}".format(token).encode("utf-8"))
+            self.env.update({
+                "GIT_CONFIG_COUNT": "1",
+                "GIT_CONFIG_KEY_0": "http.https://github.com/.extraheader",
+                "GIT_CONFIG_VALUE_0": "AUTHORIZATION: basic " + auth.decode("utf-8"),
+            })
+        if not os.path.exists(path) or (os.path.isdir(path) and not os.listdir(path)):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            self.git("init", "-q")
+            # mark the clone, it is reset and cleaned on every run
+            self.git("config", "statuspage.clone", "true")
+        elif not self.is_clone():
+            raise click.ClickException(
+                "{} is not empty and not a clone created by statuspage, refusing to "
+                "use it.".format(path)
+            )
+
+        # the remote is never stored in the clone. Reset the working copy to the remote
+        # branch, dropping anything left over from a failed run
+        self.git("fetch", "-q", self.remote, self.branch)
+        self.git("checkout", "-q", "-f", "-B", self.branch, "FETCH_HEAD")
+        self.git("clean", "-q", "-f", "-d")
+
+    def is_clone(self):
+        if not os.path.isdir(os.path.join(self.path, ".git")):
+            return False
+        process = subprocess.Popen(
+            ["git", "config", "--get", "statuspage.clone"],
+            cwd=self.path, env=self.env, stdout=subprocess.PIPE
+        )
+        return process.communicate()[0].strip() == b"true"
+
+    def git(self, *args):
+        try:
+            return subprocess.check_output(
+                ("git",) + args, cwd=self.path, env=self.env
+            ).decode("utf-8")
+        except subprocess.CalledProcessError as e:
+            # don't show the arguments, the remote may contain credentials
+            message = "Running git {} failed with exit code {}.".format(args[0], e.returncode)
+            if args[0] == "push":
+                message += " The {} branch may have changed in the meantime, run the " \
+                           "command again.".format(self.branch)
+            raise click.ClickException(message)
+
+    def read(self, path):
+        try:
+            with io.open(os.path.join(self.path, path), "r", encoding="utf-8") as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def write(self, path, content, message, sha1=None):
+        """
+        Writes the file to the working copy, the message is ignored. Returns False if the file
+        already has this content.
+        """
+        if not isinstance(content, bytes):
+            content = content.encode("utf-8")
+        full_path = os.path.join(self.path, path)
+        if os.path.isfile(full_path):
+            with open(full_path, "rb") as f:
+                if (sha1 or content_sha1(content)) == content_sha1(f.read()):
+                    return False
+        with open(full_path, "wb") as f:
+            f.write(content)
+        return True
+
+    def commit(self, message):
+        """
+        Commits and pushes all changes. Returns False if nothing changed.
+        """
+        self.git("add", "-A")
+        if not self.git("status", "--porcelain"):
+            return False
+        if subprocess.call(["git", "config", "user.email"], cwd=self.path, env=self.env,
+                           stdout=subprocess.PIPE) != 0:
+            self.git("config", "user.name", "statuspage")
+            self.git("config", "user.email", "statuspage@users.noreply.github.com")
+        self.git("commit", "-q", "-m", message)
+        self.git("push", "-q", self.remote, "HEAD:refs/heads/" + self.branch)
+        return True
+
+    def abort(self):
+        # the working copy is reset to the remote branch on the next run
+        pass
+
+
+class DirectoryOutput(object):
+    """
+    Writes files to a local directory the page is served from. `path` is a symlink to the
+    current release. Changed files are written to a new release, which commit() publishes by
+    atomically swapping the symlink, so readers never see a half written page.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        if os.path.exists(self.path) and not os.path.islink(self.path):
+            raise click.ClickException(
+                "{} already exists and is not a symlink, unable to publish to it.".format(path)
+            )
+
+        # releases live in their own directory next to the symlink, e.g. .status.releases for
+        # status, so that outputs sharing a parent directory never touch each other's releases
+        self.parent = os.path.dirname(self.path)
+        self.releases = os.path.join(
+            self.parent, "." + os.path.basename(self.path) + ".releases"
+        )
+        # the new release is only created once the first file changes
+        self.release = None
+        self.changed = False
+        self.lock = None
+
+    def create_release(self):
+        if not os.path.isdir(self.releases):
+            os.makedirs(self.releases)
+
+        # only one run at a time works on a new release, the lock is held until the release
+        # is published or aborted
+        self.lock = os.open(self.releases, os.O_RDONLY)
+        if fcntl is not None:
+            fcntl.flock(self.lock, fcntl.LOCK_EX)
+
+        # release names start with the time they were created at, so they sort by age
+        self.release = tempfile.mkdtemp(
+            prefix=datetime.utcnow().strftime("%Y%m%d%H%M%S%f-"), dir=self.releases
+        )
+        os.chmod(self.release, 0o755)
+        if os.path.isdir(self.path):
+            # hard link the current release into the new one, only changed files are written
+            os.rmdir(self.release)
+            shutil.copytree(self.path, self.release, symlinks=True, copy_function=os.link)
+
+    def unlock(self):
+        if self.lock is not None:
+            os.close(self.lock)
+            self.lock = None
+
+    def read(self, path):
+        try:
+            with io.open(os.path.join(self.release or self.path, path), "r",
+                         encoding="utf-8") as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def has_content(self, path, sha1):
+        if not os.path.isfile(path):
+            return False
+        with open(path, "rb") as f:
+            return sha1 == content_sha1(f.read())
+
+    def write(self, path, content, message, sha1=None):
+        """
+        Writes the file to the new release, the message is ignored. Returns False if the file
+        already has this content.
+        """
+        if not isinstance(content, bytes):
+            content = content.encode("utf-8")
+        sha1 = sha1 or content_sha1(content)
+        if self.release is None:
+            if self.has_content(os.path.join(self.path, path), sha1):
+                return False
+            self.create_release()
+
+        # check again, another run may have published this content while we waited for the lock
+        full_path = os.path.join(self.release, path)
+        if self.has_content(full_path, sha1):
+            return False
+        if os.path.isfile(full_path):
+            # the file is a hard link to the current release, never write to it in place
+            os.remove(full_path)
+        with open(full_path, "wb") as f:
+            f.write(content)
+        self.changed = True
+        return True
+
+    def commit(self, message):
+        """
+        Publishes the new release. Returns False if nothing changed.
+        """
+        if not self.changed:
+            self.abort()
+            return False
+
+        try:
+            if not os.path.isdir(self.release):
+                raise click.ClickException(
+                    "The new release {} is gone, not publishing it.".format(self.release)
+                )
+
+            previous = None
+            if os.path.islink(self.path):
+                previous = os.path.normpath(os.path.join(self.parent, os.readlink(self.path)))
+            link = self.release + ".link"
+            os.symlink(os.path.relpath(self.release, self.parent), link)
+            os.replace(link, self.path)
+
+            # keep the previous release around for readers that are still on it, remove the
+            # ones older than that and links left over from failed runs
+            for name in os.listdir(self.releases):
+                release = os.path.join(self.releases, name)
+                if os.path.islink(release):
+                    os.remove(release)
+                elif previous is not None and os.path.dirname(previous) == self.releases and \
+                        name < os.path.basename(previous):
+                    shutil.rmtree(release)
+        finally:
+            self.release = None
+            self.changed = False
+            self.unlock()
+        return True
+
+    def abort(self):
+        if self.release is not None:
+            shutil.rmtree(self.release, ignore_errors=True)
+            self.release = None
+        self.changed = False
+        self.unlock()
+
+
+class Peekable(object):
+    """
+    Wraps an iterator so that it can be tested for emptiness (e.g. `{% if incidents %}` in
+    templates) without consuming it.
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._peeked = []
+
+    def __bool__(self):
+        if not self._peeked:
+            try:
+                self._peeked.append(next(self._iterator))
+            except StopIteration:
+                return False
+        return True
+
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        while self._peeked:
+            yield self._peeked.pop()
+        for item in self._iterator:
+            yield item
+
+
+def iter_batches(incidents, size):
+    """
+    Groups the incidents into batches with at least `size` characters of markdown, only the
+    last batch may be smaller.
+    """
+    batch = []
+    batch_size = 0
+    for incident in incidents:
+        batch.append(incident)
+        batch_size += len(incident["body"]) + sum(
+            len(update["body"]) for update in incident["updates"]
+        )
+        if batch_size >= size:
+            yield batch
+            batch = []
+            batch_size = 0
+    if batch:
+        yield batch
+
+
+def iter_visible_issues(issues, collaborators):
     for issue in issues:
         labels = issue.get_labels()
         affected_systems = sorted(iter_systems(labels))
@@ -393,44 +796,83 @@ def get_incidents(repo, issues):
         if issue.user.login not in collaborators:
             continue
 
-        # create an incident
-        incident = {
+        # create an incident, body and updates are still markdown at this point
+        yield {
             "created": issue.created_at,
             "title": issue.title,
             "systems": affected_systems,
             "severity": severity,
             "closed": issue.state == "closed",
-            "body": markdown2.markdown(issue.body),
-            "updates": []
+            "body": issue.body or "",
+            # add comments by collaborators only
+            "updates": [
+                {"created": comment.created_at, "body": comment.body}
+                for comment in issue.get_comments() if comment.user.login in collaborators
+            ]
         }
 
-        for comment in issue.get_comments():
-            # add comments by collaborators only
-            if comment.user.login in collaborators:
-                incident["updates"].append({
-                    "created": comment.created_at,
-                    "body": markdown2.markdown(comment.body)
-                })
 
-        incidents.append(incident)
+def iter_incidents(issues, collaborators, renderer):
+    incidents = iter_visible_issues(issues, collaborators)
+    for batch in iter_batches(incidents, PARALLEL_RENDER_THRESHOLD):
+        # render all bodies of the batch in one go, in the order they appear on the page
+        texts = []
+        for incident in batch:
+            texts.append(incident["body"])
+            texts.extend(update["body"] for update in incident["updates"])
+        rendered = iter(renderer.render_all(texts))
 
-    # sort incidents by date
-    return sorted(incidents, key=lambda i: i["created"], reverse=True)
+        for incident in batch:
+            incident["body"] = next(rendered)
+            for update in incident["updates"]:
+                update["body"] = next(rendered)
+            yield incident
+
+
+def get_incidents(repo, issues, renderer=None):
+    # loop over all issues in the past 90 days to get current and past incidents. Issues are
+    # requested newest first, so the incidents are already sorted by date
+    collaborators = get_collaborators(repo=repo)
+    if renderer is None:
+        renderer = MarkdownRenderer()
+    return Peekable(iter_incidents(issues, collaborators, renderer))
 
 
 def get_issues(repo):
-    return repo.get_issues(state="all", since=datetime.now() - timedelta(days=90))
+    return repo.get_issues(
+        state="all",
+        since=datetime.now() - timedelta(days=90),
+        sort="created",
+        direction="desc"
+    )
+
+
+def render_to_buffer(template, context):
+    """
+    Renders the template chunk by chunk into a buffer. Returns the rendered content as bytes
+    and its SHA1 hex digest. The buffer is dropped on return, so only one copy of the page is
+    kept around while it is written.
+    """
+    buf = io.BytesIO()
+    sha1 = hashlib.sha1()
+    for chunk in template.generate(context):
+        chunk = chunk.encode("utf-8")
+        sha1.update(chunk)
+        buf.write(chunk)
+    return buf.getvalue(), sha1.hexdigest()
+
+
+def content_sha1(c):
+    if PY3:
+        if isinstance(c, str):
+            c = bytes(c, "utf-8")
+    else:
+        c = c.encode("utf-8")
+    return hashlib.sha1(c).hexdigest()
 
 
 def is_same_content(c1, c2):
-    def sha1(c):
-        if PY3:
-            if isinstance(c, str):
-                c = bytes(c, "utf-8")
-        else:
-            c = c.encode("utf-8")
-        return hashlib.sha1(c)
-    return sha1(c1).hexdigest() == sha1(c2).hexdigest()
+    return content_sha1(c1) == content_sha1(c2)
 
 
 if __name__ == '__main__':  # pragma: no cover
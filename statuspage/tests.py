@@ -1,13 +1,25 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function, unicode_literals
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
 import unittest
 import traceback
 from datetime import datetime
 from unittest import TestCase
 from mock import patch, Mock
 from click.testing import CliRunner
-from statuspage import cli, update, upgrade, create, iter_systems, get_severity, SYSTEM_LABEL_COLOR
+from statuspage import cli, update, upgrade, create, iter_systems, get_severity, SYSTEM_LABEL_COLOR, \
+    run_update, get_output, TEMPLATES, \
+    get_incidents, render_to_buffer, iter_batches, MarkdownRenderer, MARKDOWN_BACKENDS, GitOutput, \
+    DirectoryOutput, GitHubOutput
+from jinja2 import Template
+import hashlib
 from github import UnknownObjectException
+from click import ClickException, UsageError
+from requests.exceptions import ConnectionError
 import codecs
 
 class CLITestCase(TestCase):
@@ -80,6 +92,14 @@ class CLITestCase(TestCase):
 
         self.gh.assert_called_with("token")
 
+        # gh-pages only contains the README, the templates are created without looking them up
+        repo = self.gh().get_user().create_repo()
+        repo.get_contents.assert_not_called()
+        self.assertEqual(
+            sorted(call[1]["path"] for call in repo.create_file.call_args_list),
+            sorted(["README.md"] + TEMPLATES)
+        )
+
     @patch("statuspage.run_update")
     def test_create_org(self, run_update):
 
@@ -223,7 +243,350 @@ class UtilTestCase(TestCase):
             None
         )
 
+    def test_incidents_are_lazy(self):
+        repo = Mock()
+        repo.get_collaborators.return_value = []
+
+        incidents = get_incidents(repo, [])
+        self.assertFalse(incidents)
+        self.assertEqual(list(incidents), [])
+
+        collaborator = Mock()
+        collaborator.login = "some-dude"
+        repo.get_collaborators.return_value = [collaborator, ]
+        system = Mock()
+        system.color = SYSTEM_LABEL_COLOR
+        system.name = "API"
+        severity = Mock()
+        severity.color = "FF4D4D"
+        issues = []
+        for title in ["newest", "oldest"]:
+            issue = Mock()
+            issue.title = title
+            issue.body = title
+            issue.state = "open"
+            issue.user.login = "some-dude"
+            issue.get_labels.return_value = [system, severity]
+            issue.get_comments.return_value = []
+            issues.append(issue)
+
+        incidents = get_incidents(repo, iter(issues))
+        # comments are only fetched once the incidents are iterated
+        issues[0].get_comments.assert_not_called()
+        self.assertTrue(incidents)
+        self.assertEqual([i["title"] for i in incidents], ["newest", "oldest"])
+
+    def test_render_to_buffer(self):
+        template = Template("{% for i in items %}{{ i }}\u00e4{% endfor %}")
+        content, digest = render_to_buffer(template, {"items": iter(range(3))})
+        expected = "0\u00e41\u00e42\u00e4".encode("utf-8")
+        self.assertEqual(content, expected)
+        self.assertEqual(digest, hashlib.sha1(expected).hexdigest())
+
+    def test_batches_by_markdown_size(self):
+        def incident(body, *updates):
+            return {"body": body, "updates": [{"body": update} for update in updates]}
+
+        incidents = [incident("a" * 5), incident("b", "c" * 10), incident("d" * 3), incident("e")]
+        self.assertEqual(
+            [len(batch) for batch in iter_batches(iter(incidents), 10)],
+            [2, 2]
+        )
+        # a long thread fills a batch on its own
+        self.assertEqual(
+            [len(batch) for batch in iter_batches(iter(incidents[1:]), 10)],
+            [1, 2]
+        )
+
+    @patch("statuspage.PARALLEL_RENDER_THRESHOLD", 0)
+    def test_parallel_rendering_is_stable(self):
+        texts = ["# Incident {}\n\n* item *{}*".format(i, i) for i in range(20)]
+        for backend in MARKDOWN_BACKENDS:
+            sequential = MarkdownRenderer(backend=backend, processes=1)
+            parallel = MarkdownRenderer(backend=backend, processes=2)
+            try:
+                self.assertEqual(parallel.render_all(texts), sequential.render_all(texts))
+                self.assertIsNotNone(parallel.pool)
+            finally:
+                parallel.close()
+            self.assertIsNone(sequential.pool)
+
+
+class GitOutputTestCase(TestCase):
+
+    def git(self, *args):
+        return subprocess.check_output(("git", "-C", self.work) + args).decode("utf-8")
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.remote = os.path.join(self.tmp, "remote.git")
+        self.work = os.path.join(self.tmp, "work")
+        self.clone = os.path.join(self.tmp, "clone")
+        subprocess.check_call(["git", "init", "-q", "--bare", self.remote])
+
+        # set up a gh-pages branch with a template on the remote
+        subprocess.check_call(["git", "init", "-q", self.work])
+        self.git("config", "user.name", "test")
+        self.git("config", "user.email", "test@example.com")
+        with open(os.path.join(self.work, "template.html"), "w") as f:
+            f.write("some foo")
+        self.git("add", "-A")
+        self.git("commit", "-q", "-m", "initial")
+        self.git("push", "-q", self.remote, "HEAD:refs/heads/gh-pages")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def log(self):
+        return subprocess.check_output(
+            ["git", "--git-dir", self.remote, "log", "--format=%s", "gh-pages"]
+        ).decode("utf-8").split()
+
+    def test_commits_and_pushes_once(self):
+        output = GitOutput(path=self.clone, remote=self.remote)
+        self.assertEqual(output.read("template.html"), "some foo")
+        self.assertIsNone(output.read("index.html"))
+
+        self.assertFalse(output.write("template.html", "some foo", message="upgrade"))
+        self.assertTrue(output.write("template.html", "some other foo", message="upgrade"))
+        self.assertTrue(output.write("index.html", b"some index", message="upgrade"))
+        output.commit("upgrade")
+        self.assertEqual(self.log(), ["upgrade", "initial"])
+
+        # nothing changed, nothing to commit
+        output = GitOutput(path=self.clone, remote=self.remote)
+        self.assertFalse(output.write("index.html", "some index", message="update index"))
+        output.commit("update index")
+        self.assertEqual(self.log(), ["upgrade", "initial"])
+
+    def test_failing_git_hides_arguments(self):
+        remote = os.path.join(self.tmp, "x-access-token:SECRET@missing.git")
+        with self.assertRaises(ClickException) as e:
+            GitOutput(path=self.clone, remote=remote, token="SECRET")
+        self.assertIn("git fetch", e.exception.message)
+        self.assertNotIn("SECRET", e.exception.message)
+
+    def test_token_is_passed_through_the_environment(self):
+        output = GitOutput(path=self.clone, remote=self.remote, token="SECRET")
+        self.assertNotIn("SECRET", output.remote)
+        self.assertEqual(
+            codecs.decode(output.env["GIT_CONFIG_VALUE_0"].split()[-1].encode(), "base64"),
+            b"x-access-token:SECRET"
+        )
+
+    def test_rejected_push(self):
+        output = GitOutput(path=self.clone, remote=self.remote)
+        output.write("index.html", "some index", message="update index")
+
+        # someone else pushes while the page is rendered
+        with open(os.path.join(self.work, "template.html"), "w") as f:
+            f.write("some other foo")
+        self.git("commit", "-q", "-a", "-m", "other")
+        self.git("push", "-q", self.remote, "HEAD:refs/heads/gh-pages")
+
+        with self.assertRaises(ClickException) as e:
+            output.commit("update index")
+        self.assertIn("git push", e.exception.message)
+        self.assertEqual(self.log(), ["other", "initial"])
+
+    def test_refuses_foreign_directories(self):
+        os.makedirs(os.path.join(self.clone, "sub"))
+        with open(os.path.join(self.clone, "notes.txt"), "w") as f:
+            f.write("notes")
+        with self.assertRaises(ClickException):
+            GitOutput(path=self.clone, remote=self.remote)
+        self.assertEqual(sorted(os.listdir(self.clone)), ["notes.txt", "sub"])
+
+        # a clone of some other project
+        with self.assertRaises(ClickException):
+            GitOutput(path=self.work, remote=self.remote)
+        with open(os.path.join(self.work, "template.html")) as f:
+            self.assertEqual(f.read(), "some foo")
+
+    def test_expands_user(self):
+        with patch.dict(os.environ, {"HOME": self.tmp}):
+            output = get_output(repo=Mock(), token="token", git_dir="~/clone",
+                                git_remote=self.remote)
+        self.assertEqual(output.path, self.clone)
+        self.assertEqual(output.read("template.html"), "some foo")
+
+    def test_resets_to_remote(self):
+        output = GitOutput(path=self.clone, remote=self.remote)
+        output.write("index.html", "left over", message="update index")
+
+        output = GitOutput(path=self.clone, remote=self.remote)
+        self.assertIsNone(output.read("index.html"))
+
+
+class GitHubOutputTestCase(TestCase):
+
+    def setUp(self):
+        self.repo = Mock()
+        self.repo.get_git_ref().object.sha = "head"
+        self.index = Mock()
+        self.index.sha = "blob"
+        self.index.content = codecs.encode(b"some foo", "base64")
+        self.repo.get_contents.return_value = self.index
+
+    def test_unchanged(self):
+        output = GitHubOutput(repo=self.repo, files=["index.html"])
+        self.assertFalse(output.write(
+            "index.html", b"some foo", message="update index",
+            sha1=hashlib.sha1(b"some foo").hexdigest()
+        ))
+        self.repo.get_contents.assert_called_once_with(path="index.html", ref="head")
+        self.repo.update_file.assert_not_called()
+        self.assertFalse(output.commit("update index"))
+
+    def test_create(self):
+        output = GitHubOutput(repo=self.repo, files=[])
+        self.assertTrue(output.write("index.html", b"some foo", message="initial"))
+        self.repo.get_contents.assert_not_called()
+        self.repo.create_file.assert_called_once_with(
+            path="index.html", message="initial", content=b"some foo", branch="gh-pages"
+        )
+        self.assertTrue(output.commit("initial"))
+
+    def test_update(self):
+        output = GitHubOutput(repo=self.repo, files=["index.html"])
+        self.assertTrue(output.write("index.html", b"some other foo", message="update index"))
+        self.repo.update_file.assert_called_once_with(
+            path="index.html",
+            sha="blob",
+            message="update index",
+            content=b"some other foo",
+            branch="gh-pages"
+        )
+        self.assertTrue(output.commit("update index"))
+
+    def test_files_are_listed(self):
+        listed = Mock()
+        listed.path = "index.html"
+        self.repo.get_contents.return_value = [listed]
+        self.assertEqual(GitHubOutput(repo=self.repo).files, {"index.html"})
+        self.repo.get_contents.assert_called_once_with("/", ref="head")
+
+
+class DirectoryOutputTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "status")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def publish(self, path=None, **files):
+        output = DirectoryOutput(path=path or self.path)
+        changed = [output.write(name, content, message="update") for name, content in files.items()]
+        self.assertEqual(output.commit("update"), any(changed))
+        return changed
+
+    def releases(self, name="status"):
+        releases = os.path.join(self.tmp, "." + name + ".releases")
+        return sorted(os.listdir(releases)) if os.path.isdir(releases) else []
+
+    def test_publish(self):
+        self.assertEqual(
+            self.publish(**{"index.html": "some foo", "style.css": "foo"}),
+            [True, True]
+        )
+        self.assertTrue(os.path.islink(self.path))
+        first = os.path.realpath(self.path)
+        with open(os.path.join(self.path, "index.html")) as f:
+            self.assertEqual(f.read(), "some foo")
+
+        # readers on the current release keep seeing it while the next one is published
+        reader = open(os.path.join(self.path, "index.html"))
+        self.assertEqual(self.publish(**{"index.html": "some other foo", "style.css": "foo"}),
+                         [True, False])
+        self.assertEqual(reader.read(), "some foo")
+        reader.close()
+        with open(os.path.join(self.path, "index.html")) as f:
+            self.assertEqual(f.read(), "some other foo")
+
+        # unchanged files are shared with the previous release
+        self.assertEqual(
+            os.stat(os.path.join(first, "style.css")).st_ino,
+            os.stat(os.path.join(self.path, "style.css")).st_ino
+        )
 
+        # only the current and the previous release are kept
+        self.publish(**{"index.html": "yet another foo"})
+        self.assertEqual(len(self.releases()), 2)
+        self.assertFalse(os.path.exists(first))
+
+    def test_nothing_changed(self):
+        self.publish(**{"index.html": "some foo"})
+        current = os.path.realpath(self.path)
+        self.assertEqual(self.publish(**{"index.html": "some foo"}), [False])
+        self.assertEqual(os.path.realpath(self.path), current)
+        self.assertEqual(len(self.releases()), 1)
+
+    def test_sibling_outputs(self):
+        eu = os.path.join(self.tmp, "status-eu")
+        self.publish(path=eu, **{"index.html": "eu foo"})
+        for content in ["some foo", "some other foo", "yet another foo"]:
+            self.publish(**{"index.html": content})
+
+        self.assertEqual(len(self.releases("status-eu")), 1)
+        with open(os.path.join(eu, "index.html")) as f:
+            self.assertEqual(f.read(), "eu foo")
+
+    def test_abort(self):
+        self.publish(**{"index.html": "some foo"})
+        output = DirectoryOutput(path=self.path)
+        output.write("index.html", "some other foo", message="update")
+        self.assertEqual(len(self.releases()), 2)
+        output.abort()
+        self.assertEqual(len(self.releases()), 1)
+        with open(os.path.join(self.path, "index.html")) as f:
+            self.assertEqual(f.read(), "some foo")
+
+    def test_interleaved_outputs(self):
+        self.publish(**{"index.html": "some foo", "style.css": "foo"})
+        first = DirectoryOutput(path=self.path)
+        first.write("index.html", "first foo", message="update")
+
+        # the second run waits for the first one to publish before it creates its release
+        second = threading.Thread(target=self.publish, kwargs={"index.html": "second foo"})
+        second.start()
+        second.join(0.2)
+        self.assertTrue(second.is_alive())
+        self.assertTrue(first.commit("update"))
+        second.join()
+
+        with open(os.path.join(self.path, "index.html")) as f:
+            self.assertEqual(f.read(), "second foo")
+        with open(os.path.join(self.path, "style.css")) as f:
+            self.assertEqual(f.read(), "foo")
+        # the first release is still around as the previous one
+        self.assertEqual(len(self.releases()), 2)
+
+    def test_missing_release_is_not_published(self):
+        self.publish(**{"index.html": "some foo"})
+        current = os.path.realpath(self.path)
+        output = DirectoryOutput(path=self.path)
+        output.write("index.html", "some other foo", message="update")
+        shutil.rmtree(output.release)
+
+        with self.assertRaises(ClickException):
+            output.commit("update")
+        self.assertEqual(os.path.realpath(self.path), current)
+
+    @patch("statuspage.get_systems")
+    @patch("statuspage.get_repo")
+    def test_update_failure_leaves_nothing_behind(self, get_repo, get_systems):
+        self.publish(**{"index.html": "some foo"})
+        get_systems.side_effect = ConnectionError()
+
+        with self.assertRaises(ConnectionError):
+            run_update(name="testrepo", token="token", org=False, output_dir=self.path)
+        self.assertEqual(len(self.releases()), 1)
+
+    def test_git_options_are_rejected(self):
+        with self.assertRaises(UsageError):
+            get_output(repo=Mock(), token="token", git_dir=self.tmp, output_dir=self.path)
 
 
 if __name__ == '__main__':